@@ -1,252 +1,1199 @@
-
-import os
-import asyncio
-import logging
-import sys
-from typing import Optional
-from dataclasses import dataclass
-from pathlib import Path
-
-import google.genai.types as genai_types
-from google.adk.sessions import InMemorySessionService
-from google.adk.agents.llm_agent import LlmAgent
-from google.adk.runners import Runner
-from google.adk.tools import google_search, AgentTool
-from google.adk.tools.mcp_tool.mcp_toolset import (
-    McpToolset,
-    StdioConnectionParams,
-    StdioServerParameters,
-)
-
-# Logging configuration
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler("birding_agent.log", encoding='utf-8')
-    ],
-    force=True
-)
-
-# Suppress known GenAI async client bug
-logging.getLogger("google.genai").setLevel(logging.WARNING)
-
-logger = logging.getLogger(__name__)
-
-# PROJECT_ROOT: directory containing this agent.py file. This makes the code
-# portable (no hard-coded absolute paths).
-# EBIRD_FOLDER: relative path where the MCP eBird server (Node.js project) lives.
-# EBIRD_API_KEY:
-# - Pulled from environment for security.
-# - Fallback "YOUR_EBIRD_API_KEY" is a placeholder for local testing;
-
-PROJECT_ROOT = Path(__file__).parent.absolute()
-EBIRD_FOLDER = PROJECT_ROOT / "ebird-mcp-server"
-EBIRD_API_KEY = os.getenv("EBIRD_API_KEY", "YOUR_EBIRD_API_KEY")
-
-if not EBIRD_FOLDER.exists():
-    raise FileNotFoundError(f"eBird MCP server folder not found: {EBIRD_FOLDER}")
-
-# MCP Toolset: expose eBird MCP tools to ADK as regular tools
-# -----------------------------------------------------------------------------
-# McpToolset connects to an MCP server (the Node.js eBird server) via stdio.
-# ADK will:
-# - Discover the tools exposed by that server.
-# - Wrap them as normal ADK tools that LlmAgent can call.
-
-logger.info("Creating eBird MCP toolset...")
-#Custom Tool-MCP
-ebird_toolset = McpToolset(
-    connection_params=StdioConnectionParams(
-        server_params=StdioServerParameters(
-            command="node",
-            args=[str(EBIRD_FOLDER / "index.js"), "--api-key", EBIRD_API_KEY],
-            cwd=str(EBIRD_FOLDER),
-        ),
-    ),
-)
-
-#In-Built Tool
-# Agent 1: city_species_locator_agent
-# - Role: "backend search specialist" using Google Search tools.
-# - Responsibilities:
-#     * Resolve locations to lat/lon (city, state, country, landmark).
-#     * Resolve species names / taxonomy basics via web search.
-# - Design: Treated as a sub-agent / helper, not the main UX agent.
-
-city_species_locator_agent = LlmAgent(
-    model="gemini-2.5-flash-lite",
-    name="city_species_agent",
-    description="Location and species lookup using Google Search.",
-    # instruction:
-    #   This prompt tightly scopes the agent so the model focuses on:
-    #   - Geocoding (turning user text into coordinates).
-    #   - Species name / taxonomy lookups.
-    #   It is intentionally procedural and precise, to improve reliability.
-    instruction=(
-        "You specialize in finding latitude/longitude for cities,states,countries, locations, or landmarks. "
-        "Use Google Search to find coordinates for ANY location mentioned. "
-        "If a state is mentioned then find the capital city of that state and provide the coordinates of the capital city."
-        "If a country is mentioned then find the capital city of that country and provide the coordinates of the capital city."
-        "Extract the main city/place from the query if multiple locations are mentioned."
-        "You also specialize in finding information about any species, the scientific or common name, at any location,  that is asked. "
-        "Use Google Search to find information about any species, broader category that is asked."
-        "Extract the main species and their scientific name or common name from the query if multiple species are mentioned and then pass this information to the eBird Taxonomy tool."
-
-    ),
-    tools=[google_search],
-    # Note: This agent's response is primarily consumed by the root_agent
-    # and ebird_agent, not directly shown to the user.
-    # tools:
-    #   We give this agent only the Google Search tool so its behavior remains
-    #   focused: all external data comes from search, not MCP.
-)
-
-# Agent 2: ebird_agent
-# - Role: "eBird data specialist" using MCP tools only.
-# - Responsibilities:
-#     * Given coordinates or species, call the eBird MCP tools to:
-#         - list hotspots
-#         - fetch recent observations
-#         - query taxonomy data
-#     * Optionally fall back to general info via city_species_locator_agent (by instruction).
-ebird_agent = LlmAgent(
-    model="gemini-2.5-flash-lite",
-    name="ebird_agent",
-    description="eBird specialist using MCP tools for hotspots and observations.",
-    instruction=(
-        "You are an eBird specialist. Use the eBird MCP tools to answer birding questions. "
-        "If given latitude/longitude, use tools like list_hotspots or search_observations. "
-        "If given a city/place, FIRST ask the city_species_locator_agent for coordinates, THEN use eBird tools. "
-        "If given a general category or species/bird/common name, ask the city_species_locator_agent for common name or scientific name, THEN use eBird tools."
-        "Provide concise, useful birding insights (hotspots, recent sightings, species lists, taxonomy)."
-        "If you do not find any answers from the ebird tool, find the best answer by using the city_species_locator_agent to get information about the species and give some information in 4-5 lines about the species that is being asked"
-    ),
-    tools=[ebird_toolset],
-    #   This agent only sees the eBird MCP tools, which keeps responsibilities
-    #   clean: all heavy bird-data logic is delegated here.
-    
-)
-#Multi-Agent System
-# Agent 3: root_agent
-# - Role: Main "assistant" agent.
-# - Responsibilities:
-#     * Interpret user questions.
-#     * Decide when/how to delegate work to:
-#         - city_species_locator_agent
-#         - ebird_agent
-#     * Compose a user-friendly final answer.
-#
-# - Design:
-#     * Implemented as an LlmAgent with AgentTool entries for the two specialists.
-#     * This makes them callable tools from the root agent's perspective.
-#     * ADK web expects a global `root_agent` symbol, so this name is important.
-
-
-root_agent = LlmAgent(
-    model="gemini-2.5-flash-lite",
-    name="root_agent",
-    description="Professional birding assistant with auto-orchestration.",
-    instruction=(
-           "You are a kind, helpful and professional birding assistant. For birding/hotspot questions:\n" 
-        "1. If the user mentions a SPECIFIC CITY/PLACE, use the city_species_locator_agent "
-           "to get lat/long, then pass those coordinates to ebird_agent.\n"
-        "2. If the user mentions a SPECIFIC SPECIES/BIRD, use the city_species_locator_agent "
-           "to get the common or scientific name, then pass that to ebird_agent.\n"
-        "3. If the user asks about birds' broad general category or species/bird/common name, ask the city_species_locator_agent for common name or scientific name, then use eBird tools.\n"
-        "4. If the user already provides lat/long OR asks general birding questions, "
-           "ask city_species_locator_agent first and then consult with ebird_agent with added context.\n"
-        "5. For non-birding questions, answer directly.\n\n"
-        "Always explain briefly what you did and why."
-        "6. Always provide answer in the form of a list of 15 most relevant bird species that can be found at the location or 10-15 hotspots asked based on the data from ebird_agent."
-    ),
-    tools=[AgentTool(agent=city_species_locator_agent), AgentTool(agent=ebird_agent)],
-    #   We wrap the two sub-agents in AgentTool so the root_agent can invoke
-    #   them like tools. ADK handles passing our user/session context to them.
-)
-    
-logger.info("✅ All 3 agents ready")
-
-# BirdingAgentService
-# - Thin service layer to:
-#     * Own the InMemorySessionService (ephemeral, in-process sessions).
-#     * Own a Runner configured with the root_agent.
-#     * Provide an async `run_query` method usable from CLI/tests.
-#
-# - Design:
-#     * This isolates ADK wiring from UI / CLI code.
-#     * In production, you could swap InMemorySessionService with a persistent
-#       implementation without changing calling code. 
-
-class BirdingAgentService:
-    def __init__(self):
-        self.session_service = InMemorySessionService()
-        self.root_runner = Runner(
-            app_name="birding_app",
-            agent=root_agent,
-            session_service=self.session_service,
-        # Runner is the main ADK orchestrator:
-        # - Binds the root_agent to an app_name.
-        # - Uses session_service to keep track of multi-turn context.
-        )
-    
-    async def run_query(self, query: str) -> str:
-        """
-        Execute a single user query through the root agent.
-
-        Implementation details:
-        - Creates a fresh session for each call (stateless between runs).
-        - Wraps the user query in google.genai.types.Content.
-        - Streams events from Runner.run_async and accumulates the final text.
-        """
-        try:
-            session = await self.session_service.create_session(
-                state={}, app_name="birding_app", user_id="test"
-            )
-            # Wrap the plain text query into a GenAI Content object
-            # (role=user, with a single text Part)
-            content = genai_types.Content(role="user", parts=[genai_types.Part(text=query)])
-                        
-            response = ""
-            # run_async streams intermediate and final events.
-            # We accumulate only the final response text from the agent
-            async for event in self.root_runner.run_async(
-                session_id=session.id, user_id="test", new_message=content
-            ):
-                if (event.response and event.response.output and 
-                    event.response.output.final and event.response.output.final.text):
-                    response += event.response.output.final.text
-            
-            logger.info(f"✅ Response: {len(response)} chars")
-            return response.strip()
-            
-        except Exception as e:
-            logger.error(f"Query failed: {e}")
-            return f"Error: {str(e)}"
-
-# Simple programmatic test harness
-# - This block runs only when executing `python agent.py` directly.
-async def main():
-    """Test programmatic execution"""
-    service = BirdingAgentService()
-    
-    print("\n🧪 PROGRAMMATIC TESTS:")
-    queries = ["Birding hotspots near Boston", "Bald eagles Seattle", "Paris birds"]
-    
-    for query in queries:
-        print(f"\nQuery: {query}")
-        print("=" * 50)
-        response = await service.run_query(query)
-        print(response[:600] + "..." if len(response) > 600 else response)
-        await asyncio.sleep(1)
-
-if __name__ == "__main__":
-    # When run as a script, print quick usage hints and execute the demo queries.
-    print("🎉 Birding Agent READY!")
-    print("🌐 Web UI: 'adk web'  → http://127.0.0.1:8000")
-    print("🧪 Tests:  'python agent.py'")
-    print("-" * 50)
-
-    asyncio.run(main())
-
+
+import os
+import asyncio
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import re
+import sqlite3
+import string
+import sys
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from tenacity import (
+    AsyncRetrying,
+    before_sleep_log,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+# uvloop: libuv-backed event loop, noticeably faster than the default
+# selector loop for this async-heavy workload (streaming ADK events plus
+# MCP stdio I/O). Not available on Windows; fall back silently there.
+if sys.platform != "win32":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        uvloop = None
+
+import google.genai.types as genai_types
+from google import genai
+
+# Optional local embedder for the semantic cache. If sentence-transformers is
+# not installed we fall back to the Gemini embedding API (text-embedding-004).
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# HTTP/2 for the Gemini client
+# -----------------------------------------------------------------------------
+# google-genai builds an httpx client per genai.Client and historically
+# defaulted to HTTP/1.1 with a small connection cap, which serializes the
+# concurrent queries from main()/adk web behind TLS handshakes. We patch
+# default http_options into every genai.Client ADK constructs so all LLM
+# traffic multiplexes over one persistent HTTP/2 connection.
+try:
+    import httpx as _httpx
+    import h2  # noqa: F401 — httpx needs h2 installed for http2=True
+
+    _GENAI_CLIENT_ARGS = {
+        "http2": True,
+        "trust_env": True,
+        "limits": _httpx.Limits(max_connections=256),
+    }
+except ImportError:
+    _httpx = None
+    _GENAI_CLIENT_ARGS = None
+
+# Only patch when this google-genai release actually has the client_args
+# fields (older in-range releases don't, and HttpOptions would reject them
+# on every client construction).
+if _GENAI_CLIENT_ARGS is not None and {"client_args", "async_client_args"} <= set(
+    getattr(genai_types.HttpOptions, "model_fields", {})
+):
+    _original_client_init = genai.Client.__init__
+
+    def _client_init(self, *args, **kwargs):
+        kwargs.setdefault(
+            "http_options",
+            genai_types.HttpOptions(
+                client_args=_GENAI_CLIENT_ARGS,
+                async_client_args=_GENAI_CLIENT_ARGS,
+            ),
+        )
+        _original_client_init(self, *args, **kwargs)
+
+    genai.Client.__init__ = _client_init
+from google.adk.sessions import InMemorySessionService
+from google.adk.agents.llm_agent import LlmAgent
+from google.adk.runners import Runner
+from google.adk.tools import google_search, AgentTool, FunctionTool
+from google.adk.tools.mcp_tool.mcp_toolset import (
+    McpToolset,
+    StdioConnectionParams,
+    StdioServerParameters,
+)
+
+# orjson for the MCP JSON boundary
+# -----------------------------------------------------------------------------
+# Observation lists coming back from the eBird Node server can be large, and
+# stdlib json's pure-Python tokenizer shows up in profiles. Swap the ADK MCP
+# module's `json` reference for an orjson-backed shim (2-5x faster C parsing).
+# Only that module is patched — a shim module stands in rather than mutating
+# the process-wide stdlib json — and stdlib json remains the fallback.
+try:
+    import orjson
+    from types import ModuleType as _ModuleType
+    import google.adk.tools.mcp_tool.mcp_toolset as _mcp_toolset_module
+
+    def _fast_dumps(obj, default=None, **kwargs):
+        # orjson only understands `default`; any other stdlib kwarg
+        # (indent, sort_keys, separators, ...) goes back to stdlib json.
+        if kwargs:
+            return json.dumps(obj, default=default, **kwargs)
+        return orjson.dumps(obj, default=default).decode()
+
+    if getattr(_mcp_toolset_module, "json", None) is json:
+        _fast_json = _ModuleType("json")
+        _fast_json.loads = orjson.loads
+        _fast_json.dumps = _fast_dumps
+        _mcp_toolset_module.json = _fast_json
+except ImportError:
+    orjson = None
+
+# Logging configuration
+# Only configure the root logger if the embedding process (adk web, pytest,
+# another app) hasn't already done so — force=True would stomp its handlers.
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler("birding_agent.log", encoding='utf-8')
+        ],
+    )
+
+# Suppress known GenAI async client bug
+logging.getLogger("google.genai").setLevel(logging.WARNING)
+
+logger = logging.getLogger(__name__)
+
+# PROJECT_ROOT: directory containing this agent.py file. This makes the code
+# portable (no hard-coded absolute paths).
+# EBIRD_FOLDER: relative path where the MCP eBird server (Node.js project) lives.
+# EBIRD_API_KEY:
+# - Pulled from environment for security.
+# - Fallback "YOUR_EBIRD_API_KEY" is a placeholder for local testing;
+
+PROJECT_ROOT = Path(__file__).parent.absolute()
+EBIRD_FOLDER = PROJECT_ROOT / "ebird-mcp-server"
+# Stringified once here: str(Path) re-normalizes on every call, and these are
+# re-read on each toolset build / auto-reload.
+_EBIRD_FOLDER_STR = str(EBIRD_FOLDER)
+_EBIRD_INDEX_JS = str(EBIRD_FOLDER / "index.js")
+EBIRD_API_KEY = os.getenv("EBIRD_API_KEY", "YOUR_EBIRD_API_KEY")
+
+# Response cache configuration
+# -----------------------------------------------------------------------------
+# CACHE_DB: on-disk sqlite store so a restarted process does not re-pay the
+#   LLM cost for queries it has already answered.
+# CACHE_MAX_ENTRIES: LRU cap on the in-memory exact cache.
+# SEMANTIC_THRESHOLD: minimum cosine similarity for a cached response to be
+#   reused for a paraphrased query ("Boston birding hotspots" vs
+#   "Birding hotspots near Boston").
+CACHE_DB = PROJECT_ROOT / "birding_cache.sqlite"
+# LOOKUP_CACHE_FILE: persisted geocoding/taxonomy lookups. Users ask about the
+#   same cities and species over and over; a repeat lookup within or across
+#   processes skips both the locator-agent LLM call and its Google Search.
+LOOKUP_CACHE_FILE = PROJECT_ROOT / "locations.json"
+LOOKUP_CACHE_MAX_ENTRIES = 1024
+# Decimal lat/lon pair anywhere in the query, e.g. "47.6062, -122.3321".
+COORDS_RE = re.compile(r"(-?\d+\.\d+)[,\s]+(-?\d+\.\d+)")
+CACHE_MAX_ENTRIES = 256
+SEMANTIC_THRESHOLD = 0.92
+# Rows to grow the stacked embedding matrix by, amortizing reallocation.
+EMBEDDING_CHUNK_ROWS = 1024
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+GEMINI_EMBEDDING_MODEL = "text-embedding-004"
+
+
+# Cache-key normalization, compiled once at import. str.translate with a
+# precomputed table strips punctuation in a single C loop, and the whitespace
+# regex is compiled once instead of per query — this runs on every call to
+# stream_query and every lookup-cache access.
+_WS_RE = re.compile(r"\s+")
+_PUNCT_TABLE = str.maketrans("", "", string.punctuation)
+
+
+def _normalize_query(q: str) -> str:
+    """Lower-case, strip punctuation, and collapse whitespace for cache keys."""
+    return _WS_RE.sub(" ", q.lower().translate(_PUNCT_TABLE)).strip()
+
+
+def _is_transient_error(exc: BaseException) -> bool:
+    """
+    Rate limits, server-side 5xx, timeouts, and dropped connections are worth
+    retrying — the whole multi-agent chain would otherwise re-run at full LLM
+    cost for a spurious blip. Anything else should surface with a traceback.
+    """
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if _httpx is not None and isinstance(exc, _httpx.HTTPError):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    return code == 429 or (isinstance(code, int) and code >= 500)
+
+
+# Intent router
+# -----------------------------------------------------------------------------
+# root_agent's job is pure dispatch fully described by its instruction, yet it
+# costs a full Gemini turn per query. For well-structured queries we match the
+# query embedding against a tiny fixed intent taxonomy instead and orchestrate
+# the sub-agents from Python: at most 2 LLM hops instead of 3. root_agent
+# remains the fallback whenever the best match is below the threshold.
+INTENT_ROUTER_THRESHOLD = 0.55
+# Entity extraction for the lookup cache: best-effort and zero-LLM. Keying
+# the cache on the extracted place/species rather than the whole query is
+# what lets "Birding hotspots near Boston" and "Boston birds" share one
+# geocode.
+_LOCATION_PREP_RE = re.compile(
+    r"\b(?:near|in|at|around|from|close to)\s+([A-Z][\w.'-]*(?:\s+[A-Z][\w.'-]*)*)"
+)
+_CAPITALIZED_RUN_RE = re.compile(r"\b[A-Z][\w.'-]*(?:\s+[A-Z][\w.'-]*)*")
+_QUERY_FILLER_WORDS = frozenset(
+    "a an the and or of for me my what where which show find tell give list "
+    "best top good recent latest birding bird birds hotspot hotspots "
+    "observation observations sighting sightings near in at around from "
+    "close to".split()
+)
+INTENT_EXAMPLES = {
+    "hotspots": [
+        "find birding hotspots near Boston",
+        "best birding locations around Seattle",
+        "where can I go birding in Paris",
+        "top birding spots close to Denver",
+        "good places to watch birds near Chicago",
+        "birding hotspots in Alaska",
+    ],
+    "species": [
+        "tell me about bald eagles",
+        "recent sightings of snowy owls near me",
+        "where have peregrine falcons been seen lately",
+        "information about the american crow",
+        "what warblers are around New York right now",
+        "bald eagles Seattle",
+    ],
+    "general": [
+        "how do I start birdwatching",
+        "what binoculars are good for birding",
+        "why do birds migrate in autumn",
+    ],
+}
+
+# MCP Toolset: expose eBird MCP tools to ADK as regular tools
+# -----------------------------------------------------------------------------
+# McpToolset connects to an MCP server (the Node.js eBird server) via stdio.
+# ADK will:
+# - Discover the tools exposed by that server.
+# - Wrap them as normal ADK tools that LlmAgent can call.
+#
+# Construction is lazy (lru_cache singleton): importing agent.py — for adk
+# web discovery, tests, or any CLI command — no longer spawns the Node
+# subprocess or validates the eBird folder. The first caller pays that cost.
+
+class _BoundedMcpToolset(McpToolset):
+    """
+    McpToolset whose tools share a concurrency cap.
+
+    The eBird server is a single Node process speaking serial stdio, so
+    piling concurrent agent calls onto the pipe just causes head-of-line
+    blocking. A semaphore (EBIRD_MCP_CONCURRENCY, default 4) matches the
+    request arrival rate to what the pipe can actually serve.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._mcp_sem = asyncio.Semaphore(
+            int(os.getenv("EBIRD_MCP_CONCURRENCY", "4"))
+        )
+
+    async def get_tools(self, *args, **kwargs):
+        tools = await super().get_tools(*args, **kwargs)
+        for tool in tools:
+            if getattr(tool, "_ebird_bounded", False):
+                continue
+            original = tool.run_async
+
+            async def bounded_run(*a, _original=original, **kw):
+                async with self._mcp_sem:
+                    return await _original(*a, **kw)
+
+            tool.run_async = bounded_run
+            tool._ebird_bounded = True
+        return tools
+
+
+@functools.lru_cache(maxsize=1)
+def build_ebird_toolset() -> McpToolset:
+    """Build the eBird MCP toolset once per process (Node subprocess)."""
+    if not os.path.isdir(_EBIRD_FOLDER_STR):
+        raise FileNotFoundError(f"eBird MCP server folder not found: {_EBIRD_FOLDER_STR}")
+    logger.info("Creating eBird MCP toolset...")
+    #Custom Tool-MCP
+    return _BoundedMcpToolset(
+        connection_params=StdioConnectionParams(
+            server_params=StdioServerParameters(
+                command="node",
+                args=[_EBIRD_INDEX_JS, "--api-key", EBIRD_API_KEY],
+                cwd=_EBIRD_FOLDER_STR,
+            ),
+        ),
+    )
+
+
+def _close_ebird_toolset():
+    """Shut down the Node MCP subprocess cleanly on interpreter exit."""
+    if not build_ebird_toolset.cache_info().currsize:
+        return  # never built, nothing to close
+    try:
+        asyncio.run(build_ebird_toolset().close())
+    except Exception:
+        pass  # best-effort: the process dies with us anyway
+
+
+atexit.register(_close_ebird_toolset)
+
+#In-Built Tool
+# Agent 1: city_species_locator_agent
+# - Role: "backend search specialist" using Google Search tools.
+# - Responsibilities:
+#     * Resolve locations to lat/lon (city, state, country, landmark).
+#     * Resolve species names / taxonomy basics via web search.
+# - Design: Treated as a sub-agent / helper, not the main UX agent.
+
+@functools.lru_cache(maxsize=1)
+def build_city_species_agent() -> LlmAgent:
+    return LlmAgent(
+        model="gemini-2.5-flash-lite",
+        name="city_species_agent",
+        description="Location and species lookup using Google Search.",
+        # instruction:
+        #   This prompt tightly scopes the agent so the model focuses on:
+        #   - Geocoding (turning user text into coordinates).
+        #   - Species name / taxonomy lookups.
+        #   It is intentionally procedural and precise, to improve reliability.
+        instruction=(
+            "You specialize in finding latitude/longitude for cities,states,countries, locations, or landmarks. "
+            "Use Google Search to find coordinates for ANY location mentioned. "
+            "If a state is mentioned then find the capital city of that state and provide the coordinates of the capital city."
+            "If a country is mentioned then find the capital city of that country and provide the coordinates of the capital city."
+            "Extract the main city/place from the query if multiple locations are mentioned."
+            "You also specialize in finding information about any species, the scientific or common name, at any location,  that is asked. "
+            "Use Google Search to find information about any species, broader category that is asked."
+            "Extract the main species and their scientific name or common name from the query if multiple species are mentioned and then pass this information to the eBird Taxonomy tool."
+
+        ),
+        tools=[google_search],
+        # Note: This agent's response is primarily consumed by the root_agent
+        # and ebird_agent, not directly shown to the user.
+        # tools:
+        #   We give this agent only the Google Search tool so its behavior remains
+        #   focused: all external data comes from search, not MCP.
+    )
+
+# Agent 2: ebird_agent
+# - Role: "eBird data specialist" using MCP tools only.
+# - Responsibilities:
+#     * Given coordinates or species, call the eBird MCP tools to:
+#         - list hotspots
+#         - fetch recent observations
+#         - query taxonomy data
+#     * Optionally fall back to general info via city_species_locator_agent (by instruction).
+@functools.lru_cache(maxsize=1)
+def build_ebird_agent() -> LlmAgent:
+    return LlmAgent(
+        model="gemini-2.5-flash-lite",
+        name="ebird_agent",
+        description="eBird specialist using MCP tools for hotspots and observations.",
+        instruction=(
+            "You are an eBird specialist. Use the eBird MCP tools to answer birding questions. "
+            "If given latitude/longitude, use tools like list_hotspots or search_observations. "
+            "If given a city/place, FIRST ask the city_species_locator_agent for coordinates, THEN use eBird tools. "
+            "If given a general category or species/bird/common name, ask the city_species_locator_agent for common name or scientific name, THEN use eBird tools."
+            "Provide concise, useful birding insights (hotspots, recent sightings, species lists, taxonomy)."
+            "If you do not find any answers from the ebird tool, find the best answer by using the city_species_locator_agent to get information about the species and give some information in 4-5 lines about the species that is being asked"
+        ),
+        tools=[build_ebird_toolset()],
+        #   This agent only sees the eBird MCP tools, which keeps responsibilities
+        #   clean: all heavy bird-data logic is delegated here.
+
+    )
+
+# Lookup-cache FunctionTools
+# -----------------------------------------------------------------------------
+# root_agent still handles the common (non-routed) path, so it should benefit
+# from the lookup cache too. These module-level functions are wrapped in
+# FunctionTool inside build_root_agent — so they must be defined above it:
+# ADK_WEB=1 calls the builder eagerly at import. They reach the cache through
+# a process-wide default service, which also covers adk web (where the
+# framework never constructs a BirdingAgentService of its own).
+_default_service_instance: Optional["BirdingAgentService"] = None
+
+
+def _default_service() -> "BirdingAgentService":
+    global _default_service_instance
+    if _default_service_instance is None:
+        _default_service_instance = BirdingAgentService()
+    return _default_service_instance
+
+
+async def lookup_location_cached(name: str) -> str:
+    """Find the latitude and longitude of a city, state, country, or landmark.
+
+    Answers are cached across queries and restarts, so repeat lookups are
+    instant and cost no search.
+    """
+    return await _default_service().lookup_location(name)
+
+
+async def lookup_species_cached(name: str) -> str:
+    """Find the common name and scientific name of a bird species.
+
+    Answers are cached across queries and restarts, so repeat lookups are
+    instant and cost no search.
+    """
+    return await _default_service().lookup_species(name)
+
+
+#Multi-Agent System
+# Agent 3: root_agent
+# - Role: Main "assistant" agent.
+# - Responsibilities:
+#     * Interpret user questions.
+#     * Decide when/how to delegate work to:
+#         - city_species_locator_agent
+#         - ebird_agent
+#     * Compose a user-friendly final answer.
+#
+# - Design:
+#     * Implemented as an LlmAgent with AgentTool entries for the two specialists.
+#     * This makes them callable tools from the root agent's perspective.
+#     * ADK web expects a global `root_agent` symbol — we only materialize it
+#       at module scope when running under adk web (ADK_WEB=1) or as a script.
+
+
+@functools.lru_cache(maxsize=1)
+def build_root_agent() -> LlmAgent:
+    """Construct the full 3-agent system once, on first use."""
+    root = LlmAgent(
+        model="gemini-2.5-flash-lite",
+        name="root_agent",
+        description="Professional birding assistant with auto-orchestration.",
+        instruction=(
+               "You are a kind, helpful and professional birding assistant. For birding/hotspot questions:\n"
+            "1. If the user mentions a SPECIFIC CITY/PLACE, use the city_species_locator_agent "
+               "to get lat/long, then pass those coordinates to ebird_agent.\n"
+            "2. If the user mentions a SPECIFIC SPECIES/BIRD, use the city_species_locator_agent "
+               "to get the common or scientific name, then pass that to ebird_agent.\n"
+            "3. If the user asks about birds' broad general category or species/bird/common name, ask the city_species_locator_agent for common name or scientific name, then use eBird tools.\n"
+            "4. If the user already provides lat/long OR asks general birding questions, "
+               "ask city_species_locator_agent first and then consult with ebird_agent with added context.\n"
+            "5. For non-birding questions, answer directly.\n\n"
+            "Always explain briefly what you did and why."
+            "6. Always provide answer in the form of a list of 15 most relevant bird species that can be found at the location or 10-15 hotspots asked based on the data from ebird_agent.\n"
+            "Prefer lookup_location_cached and lookup_species_cached for plain coordinate or species-name lookups — they are cached and instant on repeats — and use the city_species_locator_agent only when they cannot answer."
+        ),
+        tools=[
+            AgentTool(agent=build_city_species_agent()),
+            AgentTool(agent=build_ebird_agent()),
+            FunctionTool(func=lookup_location_cached),
+            FunctionTool(func=lookup_species_cached),
+        ],
+        #   We wrap the two sub-agents in AgentTool so the root_agent can invoke
+        #   them like tools. ADK handles passing our user/session context to them.
+    )
+    logger.info("✅ All 3 agents ready")
+    return root
+
+
+# adk web imports this module and looks for a global `root_agent`; building
+# it eagerly only in that case keeps plain imports (tests, tooling) cheap.
+if os.getenv("ADK_WEB") == "1":
+    root_agent = build_root_agent()
+
+# BirdingAgentService
+# - Thin service layer to:
+#     * Own the InMemorySessionService (ephemeral, in-process sessions).
+#     * Own a Runner configured with the root_agent.
+#     * Provide an async `run_query` method usable from CLI/tests.
+#
+# - Design:
+#     * This isolates ADK wiring from UI / CLI code.
+#     * In production, you could swap InMemorySessionService with a persistent
+#       implementation without changing calling code. 
+
+class BirdingAgentService:
+    def __init__(self):
+        # First service constructed becomes the process-wide default that
+        # backs the lookup FunctionTools exposed to root_agent.
+        global _default_service_instance
+        if _default_service_instance is None:
+            _default_service_instance = self
+        self.session_service = InMemorySessionService()
+        self.root_runner = Runner(
+            app_name="birding_app",
+            agent=build_root_agent(),
+            session_service=self.session_service,
+        # Runner is the main ADK orchestrator:
+        # - Binds the root_agent to an app_name.
+        # - Uses session_service to keep track of multi-turn context.
+        )
+        # Long-lived default session, created lazily on first use and reused
+        # across queries so the runner can benefit from prefix/context reuse
+        # instead of paying per-query session allocation. The lock keeps a
+        # warmup racing a first query from double-creating it.
+        self._default_session = None
+        self._session_lock = asyncio.Lock()
+        # Bound concurrent agent runs so parallel callers (asyncio.gather,
+        # adk web) don't trip Gemini rate limits.
+        self._llm_sem = asyncio.Semaphore(
+            int(os.getenv("BIRDING_LLM_CONCURRENCY", "3"))
+        )
+        # The eBird MCP toolset is a module-level singleton so the Node
+        # subprocess is forked once per Python process; pay that cost up
+        # front (first caller wins, the lock stops a thundering herd).
+        self._mcp_warmed = False
+        self._mcp_warm_lock = asyncio.Lock()
+        # Dedicated runner for the lat/lon fast path (built lazily): when the
+        # user already supplies coordinates, the root_agent dispatch hop and
+        # the geocoding hop are pure overhead — go straight to ebird_agent.
+        self._ebird_runner: Optional[Runner] = None
+        # Intent router state: embeddings of INTENT_EXAMPLES stacked once on
+        # first use, plus a runner bound to the locator agent so Python can
+        # orchestrate the two specialists without a root_agent turn.
+        self._city_runner: Optional[Runner] = None
+        self._intent_matrix: Optional[np.ndarray] = None
+        self._intent_labels: list[str] = []
+        # Geocoding/taxonomy lookup cache (normalized name -> locator answer),
+        # loaded from and persisted to locations.json. The lock keeps
+        # concurrent misses for the same name from racing the sub-agent.
+        self._lookup_cache: dict[str, str] = self._load_lookup_cache()
+        self._lookup_lock = asyncio.Lock()
+        # Two-tier response cache:
+        # - _exact_cache: normalized query -> response, LRU-bounded.
+        # - _emb_matrix: cached prompt embeddings pre-stacked as an int8
+        #   (N, D) matrix with per-row float32 scales, grown in
+        #   EMBEDDING_CHUNK_ROWS blocks. One integer matrix-vector product
+        #   scores every cached prompt at once; int8 storage halves memory
+        #   bandwidth versus float32, which dominates once the cache warms.
+        # The LRU cap bounds both tiers: evicting a key tombstones its
+        # embedding row (and drops the response string), and the matrix is
+        # compacted once tombstones reach half the rows.
+        # Both tiers are warmed from the sqlite store so restarts don't
+        # re-pay the multi-agent LLM cost.
+        self._exact_cache: OrderedDict[str, str] = OrderedDict()
+        self._emb_matrix: Optional[np.ndarray] = None
+        self._emb_scales: Optional[np.ndarray] = None
+        self._emb_count = 0
+        self._emb_dead = 0
+        self._emb_responses: list[Optional[str]] = []
+        self._emb_keys: list[Optional[str]] = []
+        self._key_to_row: dict[str, int] = {}
+        self._embedder = (
+            SentenceTransformer(EMBEDDING_MODEL) if SentenceTransformer else None
+        )
+        self._embedder_name = (
+            EMBEDDING_MODEL if self._embedder is not None else GEMINI_EMBEDDING_MODEL
+        )
+        # One Gemini client for embedding fallback — constructing a client
+        # per call would re-pay the connection setup on every cache miss.
+        self._genai_client: Optional[genai.Client] = None
+        self._cache_db = sqlite3.connect(str(CACHE_DB))
+        self._cache_db.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, embedding BLOB, response TEXT)"
+        )
+        self._cache_db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        # Embeddings are only comparable within one model's space (and the
+        # local MiniLM is 384-dim while text-embedding-004 is 768-dim, the
+        # exact swap that happens when sentence-transformers is absent).
+        # If the store was written by a different embedder, drop its
+        # embeddings — the exact-tier responses stay usable.
+        meta = self._cache_db.execute(
+            "SELECT value FROM cache_meta WHERE key = 'embedder'"
+        ).fetchone()
+        if meta is not None and meta[0] != self._embedder_name:
+            logger.warning(
+                "Cached embeddings came from %s but the current embedder is %s"
+                " — discarding them",
+                meta[0], self._embedder_name,
+            )
+            self._cache_db.execute("UPDATE response_cache SET embedding = NULL")
+        self._cache_db.execute(
+            "INSERT OR REPLACE INTO cache_meta VALUES ('embedder', ?)",
+            (self._embedder_name,),
+        )
+        self._cache_db.commit()
+        self._load_cache()
+        # Kick off warmup in the background when constructed inside a running
+        # loop (e.g. adk web); synchronous callers await warmup() themselves.
+        # Keep a reference — a bare create_task can be garbage-collected
+        # before it finishes.
+        self._warmup_task: Optional[asyncio.Task] = None
+        try:
+            asyncio.get_running_loop()
+            self._warmup_task = asyncio.create_task(self._do_warmup())
+        except RuntimeError:
+            pass
+
+    async def warmup(self):
+        """
+        Idempotent warmup: if a run is already in flight (e.g. the one the
+        constructor scheduled), await it instead of paying the throwaway
+        prompt twice.
+        """
+        if self._warmup_task is None:
+            self._warmup_task = asyncio.create_task(self._do_warmup())
+        await self._warmup_task
+
+    async def _do_warmup(self):
+        """
+        Pay one-time costs off the critical path: start the MCP Node server
+        (tool discovery) and send a throwaway prompt through the root runner
+        so TLS handshake + model auth happen before the first real query.
+        """
+        await self._ensure_mcp_warm()
+        try:
+            content = genai_types.Content(
+                role="user", parts=[genai_types.Part(text="ok")]
+            )
+            # Ping on a throwaway session: the default session is reused by
+            # every real query, and the junk turn (plus whatever partial turn
+            # the timeout cancellation leaves behind) must not become
+            # conversation history they all inherit.
+            ping_session = await self.session_service.create_session(
+                state={}, app_name="birding_app", user_id="warmup"
+            )
+
+            async def _ping():
+                async for _ in self.root_runner.run_async(
+                    session_id=ping_session.id, user_id="warmup", new_message=content
+                ):
+                    pass
+
+            await asyncio.wait_for(_ping(), timeout=2.0)
+        except asyncio.TimeoutError:
+            pass  # connection is established; the response doesn't matter
+        except Exception as e:
+            logger.warning("Model warm-up failed (first query pays it): %s", e)
+
+    def _load_cache(self):
+        """Rehydrate both cache tiers from the sqlite store."""
+        rows = self._cache_db.execute(
+            "SELECT key, embedding, response FROM response_cache"
+        ).fetchall()
+        for key, blob, response in rows[-CACHE_MAX_ENTRIES:]:
+            self._exact_cache[key] = response
+            if blob is not None:
+                self._append_embedding(
+                    key, np.frombuffer(blob, dtype=np.float32), response
+                )
+        if rows:
+            logger.info("Loaded %d cached responses", len(self._exact_cache))
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """
+        Embed `text` to a unit-norm float32 vector, or None if no embedder
+        is available. Prefers the local sentence-transformers model; falls
+        back to the Gemini embedding API.
+        """
+        try:
+            if self._embedder is not None:
+                # encode() is CPU-bound (a PyTorch forward pass); run it in a
+                # worker thread so it doesn't stall the event loop.
+                vector = np.asarray(
+                    await asyncio.to_thread(self._embedder.encode, text),
+                    dtype=np.float32,
+                )
+            else:
+                if self._genai_client is None:
+                    self._genai_client = genai.Client()
+                result = await self._genai_client.aio.models.embed_content(
+                    model=GEMINI_EMBEDDING_MODEL, contents=text
+                )
+                vector = np.asarray(
+                    result.embeddings[0].values, dtype=np.float32
+                )
+            return vector / np.linalg.norm(vector)
+        except Exception as e:
+            logger.warning("Embedding failed, semantic cache skipped: %s", e)
+            return None
+
+    @staticmethod
+    def _quantize(embedding: np.ndarray) -> tuple[np.ndarray, float]:
+        """Quantize a float32 vector to int8 with a per-vector scale."""
+        scale = float(np.max(np.abs(embedding))) / 127.0
+        if scale == 0.0:
+            scale = 1.0
+        return np.round(embedding / scale).astype(np.int8), scale
+
+    def _append_embedding(self, key: str, embedding: np.ndarray, response: str):
+        """Quantize and append an embedding row, growing the matrix in chunks."""
+        if key in self._key_to_row:
+            self._evict_embedding(key)
+        embedding = np.ascontiguousarray(embedding, dtype=np.float32)
+        if (
+            self._emb_matrix is not None
+            and embedding.shape[0] != self._emb_matrix.shape[1]
+        ):
+            # Stale row from another embedder's dimension — a mismatched row
+            # would make every subsequent lookup matmul raise.
+            logger.warning(
+                "Dropping embedding with dim %d (matrix is %d-dim)",
+                embedding.shape[0], self._emb_matrix.shape[1],
+            )
+            return
+        quantized, scale = self._quantize(embedding)
+        if self._emb_matrix is None:
+            self._emb_matrix = np.zeros(
+                (EMBEDDING_CHUNK_ROWS, embedding.shape[0]), dtype=np.int8
+            )
+            self._emb_scales = np.zeros(EMBEDDING_CHUNK_ROWS, dtype=np.float32)
+        elif self._emb_count == self._emb_matrix.shape[0]:
+            self._emb_matrix = np.vstack(
+                [
+                    self._emb_matrix,
+                    np.zeros_like(self._emb_matrix[:EMBEDDING_CHUNK_ROWS]),
+                ]
+            )
+            self._emb_scales = np.concatenate(
+                [self._emb_scales, np.zeros(EMBEDDING_CHUNK_ROWS, dtype=np.float32)]
+            )
+        self._emb_matrix[self._emb_count] = quantized
+        self._emb_scales[self._emb_count] = scale
+        self._key_to_row[key] = self._emb_count
+        self._emb_count += 1
+        self._emb_responses.append(response)
+        self._emb_keys.append(key)
+
+    def _evict_embedding(self, key: str):
+        """
+        Tombstone the embedding row for an evicted key: zero the scale (so
+        its score can never clear the threshold) and drop the response
+        string. Rows are reclaimed in bulk by _compact_embeddings.
+        """
+        row = self._key_to_row.pop(key, None)
+        if row is None:
+            return
+        self._emb_scales[row] = 0.0
+        self._emb_responses[row] = None
+        self._emb_keys[row] = None
+        self._emb_dead += 1
+        if self._emb_dead * 2 >= self._emb_count:
+            self._compact_embeddings()
+
+    def _compact_embeddings(self):
+        """Rebuild the matrix with live rows only, reclaiming tombstones."""
+        live = [row for row in range(self._emb_count) if self._emb_keys[row] is not None]
+        self._emb_matrix[: len(live)] = self._emb_matrix[live]
+        self._emb_scales[: len(live)] = self._emb_scales[live]
+        self._emb_responses = [self._emb_responses[row] for row in live]
+        self._emb_keys = [self._emb_keys[row] for row in live]
+        self._key_to_row = {key: i for i, key in enumerate(self._emb_keys)}
+        self._emb_count = len(live)
+        self._emb_dead = 0
+
+    def _semantic_lookup(self, embedding: np.ndarray) -> Optional[str]:
+        """Return a cached response whose prompt is close enough to `embedding`."""
+        if self._emb_count == 0:
+            return None
+        if embedding.shape[0] != self._emb_matrix.shape[1]:
+            # Dimension drift (embedder changed mid-process): skip rather
+            # than let the matmul raise on every query.
+            return None
+        # Quantize the query the same way, do one integer matrix-vector
+        # product over the int8 matrix (int32 accumulation avoids overflow
+        # for D ~ 768), then rescale back to cosine similarities — the
+        # cached rows and the query are unit-norm before quantization.
+        q8, q_scale = self._quantize(embedding)
+        raw = self._emb_matrix[: self._emb_count].astype(np.int32) @ q8.astype(
+            np.int32
+        )
+        scores = raw * self._emb_scales[: self._emb_count] * q_scale
+        idx = int(scores.argmax())
+        if scores[idx] >= SEMANTIC_THRESHOLD:
+            logger.info("✅ Semantic cache hit (score=%.3f)", scores[idx])
+            return self._emb_responses[idx]
+        return None
+
+    def _store_cache(self, key: str, embedding: Optional[np.ndarray], response: str):
+        """Insert into both cache tiers and persist to sqlite, evicting LRU."""
+        self._exact_cache[key] = response
+        self._exact_cache.move_to_end(key)
+        while len(self._exact_cache) > CACHE_MAX_ENTRIES:
+            evicted, _ = self._exact_cache.popitem(last=False)
+            self._evict_embedding(evicted)
+            self._cache_db.execute(
+                "DELETE FROM response_cache WHERE key = ?", (evicted,)
+            )
+        if embedding is not None:
+            self._append_embedding(key, embedding, response)
+        self._cache_db.execute(
+            "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?)",
+            (key, embedding.tobytes() if embedding is not None else None, response),
+        )
+        self._cache_db.commit()
+
+    @staticmethod
+    def _preclassify(query: str) -> dict:
+        """
+        Cheap Python-side dispatch: detect an explicit lat/lon pair in the
+        query so we can skip the LLM hops that would only rediscover it.
+        """
+        match = COORDS_RE.search(query)
+        if match:
+            return {"lat": float(match.group(1)), "lng": float(match.group(2))}
+        return {}
+
+    def _get_ebird_runner(self) -> Runner:
+        """Runner bound directly to ebird_agent for coordinate fast-path queries."""
+        if self._ebird_runner is None:
+            self._ebird_runner = Runner(
+                app_name="birding_app",
+                agent=build_ebird_agent(),
+                session_service=self.session_service,
+            )
+        return self._ebird_runner
+
+    def _get_city_runner(self) -> Runner:
+        """Runner bound to the locator agent for Python-orchestrated dispatch."""
+        if self._city_runner is None:
+            self._city_runner = Runner(
+                app_name="birding_app",
+                agent=build_city_species_agent(),
+                session_service=self.session_service,
+            )
+        return self._city_runner
+
+    @staticmethod
+    def _load_lookup_cache() -> dict:
+        """Load persisted geocoding/taxonomy lookups, tolerating a bad file."""
+        try:
+            with open(LOOKUP_CACHE_FILE, encoding="utf-8") as f:
+                return dict(json.load(f))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_lookup_cache(self):
+        try:
+            with open(LOOKUP_CACHE_FILE, "w", encoding="utf-8") as f:
+                json.dump(self._lookup_cache, f)
+        except OSError as e:
+            logger.warning("Could not persist lookup cache: %s", e)
+
+    @staticmethod
+    def _extract_entities(query: str) -> dict:
+        """
+        Best-effort location/species extraction without an LLM call.
+        Prefers a capitalized run after a place preposition ("near Boston");
+        otherwise falls back to the last non-filler capitalized run ("Bald
+        eagles Seattle" -> "Seattle"). Whatever non-filler words remain after
+        removing the location are treated as the species ("Bald eagles").
+        """
+        entities = {}
+        match = _LOCATION_PREP_RE.search(query)
+        if match:
+            entities["location"] = match.group(1)
+        else:
+            runs = [m.group(0) for m in _CAPITALIZED_RUN_RE.finditer(query)]
+            candidates = [
+                run
+                for i, run in enumerate(runs)
+                if run.lower() not in _QUERY_FILLER_WORDS
+                # A sentence-leading capital is usually not a place name
+                # unless it's the only candidate ("Paris birds").
+                and not (i == 0 and query.startswith(run) and len(runs) > 1)
+            ]
+            if candidates:
+                entities["location"] = candidates[-1]
+        remainder = query
+        if "location" in entities:
+            remainder = remainder.replace(entities["location"], " ")
+        species_words = [
+            word
+            for word in re.findall(r"[A-Za-z'-]+", remainder)
+            if word.lower() not in _QUERY_FILLER_WORDS
+        ]
+        if species_words:
+            entities["species"] = " ".join(species_words)
+        return entities
+
+    async def _cached_lookup(self, kind: str, name: str, prompt: str) -> str:
+        """
+        Run a locator-agent lookup once per (kind, normalized name) and
+        remember the answer across queries and process restarts.
+        """
+        cache_key = f"{kind}:{_normalize_query(name)}"
+        if cache_key in self._lookup_cache:
+            logger.info("✅ Lookup cache hit: %s", cache_key)
+            return self._lookup_cache[cache_key]
+        async with self._lookup_lock:
+            if cache_key in self._lookup_cache:
+                return self._lookup_cache[cache_key]
+            # Throwaway session: lookups must not pollute the shared default
+            # session's history. limit_concurrency=False because this can run
+            # nested inside an agent turn that already holds an _llm_sem
+            # permit (the FunctionTool path) — re-acquiring would deadlock.
+            session = await self.session_service.create_session(
+                state={}, app_name="birding_app", user_id="test"
+            )
+            answer = await self._run_agent(
+                self._get_city_runner(), prompt, session.id, limit_concurrency=False
+            )
+            if answer:
+                if len(self._lookup_cache) >= LOOKUP_CACHE_MAX_ENTRIES:
+                    self._lookup_cache.pop(next(iter(self._lookup_cache)))
+                self._lookup_cache[cache_key] = answer
+                self._save_lookup_cache()
+            return answer
+
+    async def lookup_location(self, name: str) -> str:
+        """Resolve a city/place to coordinates via the locator agent, cached."""
+        return await self._cached_lookup(
+            "loc", name, f"Find the latitude and longitude of: {name}"
+        )
+
+    async def lookup_species(self, name: str) -> str:
+        """Resolve a species to common/scientific names via the locator agent, cached."""
+        return await self._cached_lookup(
+            "species",
+            name,
+            f"Find the common name and scientific name of the species: {name}",
+        )
+
+    async def _route_intent(self, embedding: np.ndarray) -> tuple[str, float]:
+        """
+        Match the query embedding against the canonical intent examples.
+        Returns (intent, best score); ("general", 0.0) if embedding the
+        taxonomy fails, which sends the query down the root_agent path.
+        """
+        if self._intent_matrix is None:
+            rows, labels = [], []
+            for intent, examples in INTENT_EXAMPLES.items():
+                for example in examples:
+                    vector = await self._embed(example)
+                    if vector is None:
+                        return "general", 0.0
+                    rows.append(vector)
+                    labels.append(intent)
+            self._intent_matrix = np.vstack(rows).astype(np.float32)
+            self._intent_labels = labels
+        scores = self._intent_matrix @ embedding
+        idx = int(scores.argmax())
+        return self._intent_labels[idx], float(scores[idx])
+
+    async def _ensure_mcp_warm(self):
+        """Start the Node MCP server (tool discovery) once, before first use."""
+        if self._mcp_warmed:
+            return
+        async with self._mcp_warm_lock:
+            if self._mcp_warmed:
+                return
+            try:
+                tools = await build_ebird_toolset().get_tools()
+                logger.info("✅ eBird MCP server warm (%d tools)", len(tools))
+            except Exception as e:
+                logger.warning("MCP warm-up failed (will retry lazily): %s", e)
+                return
+            self._mcp_warmed = True
+
+    async def _get_session(self, user_id: str = "test"):
+        """Create the default session once and reuse it on later calls."""
+        if self._default_session is None:
+            async with self._session_lock:
+                if self._default_session is None:
+                    self._default_session = await self.session_service.create_session(
+                        state={}, app_name="birding_app", user_id=user_id
+                    )
+        return self._default_session
+
+    async def run_query(self, query: str, session_id: Optional[str] = None) -> str:
+        """Execute a query and return the complete response as one string."""
+        # Strip like the cache does, so the first run and a later cache hit
+        # for the same query return identical strings.
+        return "".join(
+            [chunk async for chunk in self.stream_query(query, session_id)]
+        ).strip()
+
+    async def stream_query(
+        self, query: str, session_id: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Execute a single user query, yielding response text incrementally.
+
+        Streaming means the caller sees the first chunk at first-event
+        latency instead of waiting for the whole multi-agent run to finish.
+
+        Implementation details:
+        - Checks the exact cache (normalized query) and the semantic cache
+          (embedding cosine similarity) before touching the agent at all;
+          cache hits are yielded as a single chunk.
+        - Reuses a long-lived default session unless `session_id` is given.
+        - Wraps the user query in google.genai.types.Content.
+        - Streams events from Runner.run_async, yielding each final-text
+          chunk as it arrives.
+        """
+        # Tier 1: exact match on the normalized query.
+        key = _normalize_query(query)
+        if key in self._exact_cache:
+            self._exact_cache.move_to_end(key)
+            logger.info("✅ Exact cache hit")
+            yield self._exact_cache[key]
+            return
+
+        # Tier 2: cosine similarity against cached prompts (paraphrases).
+        embedding = await self._embed(key)
+        if embedding is not None:
+            cached = self._semantic_lookup(embedding)
+            if cached is not None:
+                yield cached
+                return
+
+        try:
+            await self._ensure_mcp_warm()
+            if session_id is None:
+                session_id = (await self._get_session()).id
+
+            # Fast path: a query that already carries lat/lon needs neither
+            # the root dispatch turn nor the geocoding turn — hand it to
+            # ebird_agent directly, cutting the chain from 3 LLM hops to 1.
+            runner = self.root_runner
+            prompt = query
+            if self._preclassify(query):
+                logger.info("Coordinates detected, dispatching straight to ebird_agent")
+                runner = self._get_ebird_runner()
+            elif embedding is not None:
+                # Zero-LLM routing: match the query embedding against the
+                # intent taxonomy and orchestrate the two specialists from
+                # Python (2 hops) instead of letting root_agent dispatch
+                # (3 hops). Low-confidence matches keep the full flow.
+                intent, score = await self._route_intent(embedding)
+                if score >= INTENT_ROUTER_THRESHOLD and intent in ("hotspots", "species"):
+                    logger.info(
+                        "Intent router: %s (score=%.3f), skipping root_agent",
+                        intent, score,
+                    )
+                    # Look up the extracted entities, not the whole query, so
+                    # "Birding hotspots near Boston" and "Boston birds" share
+                    # one cached geocode.
+                    entities = self._extract_entities(query)
+                    lookups = []
+                    if intent == "species" and entities.get("species"):
+                        lookups.append(await self.lookup_species(entities["species"]))
+                    if entities.get("location"):
+                        lookups.append(await self.lookup_location(entities["location"]))
+                    if not lookups:
+                        # Nothing extractable — fall back to a whole-query lookup.
+                        lookups.append(
+                            await self._cached_lookup(
+                                intent,
+                                query,
+                                "Find the coordinates of the location and/or the "
+                                f"common and scientific species names in: {query}",
+                            )
+                        )
+                    lookup = "\n".join(lookups)
+                    runner = self._get_ebird_runner()
+                    prompt = f"{query}\n\nLookup context: {lookup}"
+
+            # Yield chunks to the caller as they arrive while keeping a copy
+            # so the completed response can still be cached.
+            parts = []
+            async for chunk in self._stream_agent(runner, prompt, session_id):
+                parts.append(chunk)
+                yield chunk
+            response = "".join(parts)
+
+            logger.info("✅ Response: %d chars", len(response))
+            response = response.strip()
+            if response:
+                self._store_cache(key, embedding, response)
+
+        except Exception:
+            # Transient errors were already retried in _stream_agent; what
+            # reaches here is a real bug or exhausted retries — propagate
+            # with the full traceback instead of a flattened string.
+            logger.exception("Query failed")
+            raise
+
+    async def _run_agent(
+        self,
+        runner: Runner,
+        text: str,
+        session_id: str,
+        limit_concurrency: bool = True,
+    ) -> str:
+        """Send `text` through `runner` and collect the final response text."""
+        return "".join(
+            [
+                chunk
+                async for chunk in self._stream_agent(
+                    runner, text, session_id, limit_concurrency=limit_concurrency
+                )
+            ]
+        )
+
+    async def _stream_agent(
+        self,
+        runner: Runner,
+        text: str,
+        session_id: str,
+        limit_concurrency: bool = True,
+    ) -> AsyncIterator[str]:
+        """
+        Send `text` through `runner`, yielding final-text chunks as they arrive.
+
+        `limit_concurrency=False` skips the _llm_sem guard for runs nested
+        inside an agent turn that already holds a permit.
+        """
+        # Wrap the plain text query into a GenAI Content object
+        # (role=user, with a single text Part)
+        content = genai_types.Content(role="user", parts=[genai_types.Part(text=text)])
+
+        yielded = False
+
+        def _retryable(exc: BaseException) -> bool:
+            # Once chunks have reached the caller we can't transparently
+            # re-run the agent; let the error surface instead.
+            return not yielded and _is_transient_error(exc)
+
+        # run_async streams intermediate and final events; we pass through
+        # only the final response text from the agent, chunk by chunk.
+        # Transient failures (429/5xx/timeouts) are retried with exponential
+        # backoff + jitter before the first chunk is emitted.
+        async for attempt in AsyncRetrying(
+            wait=wait_exponential_jitter(initial=0.5, max=8),
+            stop=stop_after_attempt(4),
+            retry=retry_if_exception(_retryable),
+            before_sleep=before_sleep_log(logger, logging.WARNING),
+            reraise=True,
+        ):
+            with attempt:
+                # A failed attempt has already appended its user message (and
+                # any partial events) to the session, so re-running on the
+                # same session_id would duplicate the turn in shared history.
+                # Retries go to a fresh throwaway session instead.
+                attempt_session_id = session_id
+                if attempt.retry_state.attempt_number > 1:
+                    retry_session = await self.session_service.create_session(
+                        state={}, app_name="birding_app", user_id="test"
+                    )
+                    attempt_session_id = retry_session.id
+                sem = self._llm_sem if limit_concurrency else contextlib.nullcontext()
+                async with sem:
+                    async for event in runner.run_async(
+                        session_id=attempt_session_id, user_id="test", new_message=content
+                    ):
+                        out = getattr(
+                            getattr(getattr(event, "response", None), "output", None),
+                            "final",
+                            None,
+                        )
+                        if out is not None and out.text:
+                            yielded = True
+                            yield out.text
+
+# Simple programmatic test harness
+# - This block runs only when executing `python agent.py` directly.
+async def main():
+    """Test programmatic execution"""
+    service = BirdingAgentService()
+    
+    print("\n🧪 PROGRAMMATIC TESTS:")
+    queries = ["Birding hotspots near Boston", "Bald eagles Seattle", "Paris birds"]
+
+    # Pay MCP startup + model handshake before timing-sensitive queries.
+    await service.warmup()
+    
+    # Stream each demo query so output appears at first-event latency
+    # instead of after the whole multi-agent run. (Interleaving streamed
+    # chunks from concurrent queries would garble the console, so the demo
+    # streams serially; batch callers can still asyncio.gather run_query.)
+    for query in queries:
+        print(f"\nQuery: {query}")
+        print("=" * 50)
+        async for chunk in service.stream_query(query):
+            print(chunk, end="", flush=True)
+        print()
+
+if __name__ == "__main__":
+    # When run as a script, print quick usage hints and execute the demo queries.
+    print("🎉 Birding Agent READY!")
+    print("🌐 Web UI: 'ADK_WEB=1 adk web'  → http://127.0.0.1:8000")
+    print("🧪 Tests:  'python agent.py'")
+    print("-" * 50)
+
+    asyncio.run(main())
+
@@ -1,20 +1,26 @@
-#!/usr/bin/env python3
-import os
-import subprocess
-import sys
-
-def install_requirements():
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
-    print("✅ Python dependencies installed!")
-
-def setup_ebird_mcp():
-    os.chdir("ebird-mcp-server")
-    subprocess.check_call(["npm", "install"])
-    print("✅ eBird MCP server ready!")
-    os.chdir("..")
-
-if __name__ == "__main__":
-    print("🦅 Setting up Birding Agent...")
-    install_requirements()
-    setup_ebird_mcp()
-    print("\n🚀 Ready! Run: adk web")
\ No newline at end of file
+#!/usr/bin/env python3
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+def install_requirements():
+    subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
+    print("✅ Python dependencies installed!")
+
+def setup_ebird_mcp():
+    # cwd= keeps this thread-safe; os.chdir would corrupt the working
+    # directory for the concurrently running pip install.
+    subprocess.check_call(["npm", "install"], cwd="ebird-mcp-server")
+    print("✅ eBird MCP server ready!")
+
+if __name__ == "__main__":
+    print("🦅 Setting up Birding Agent...")
+    # pip and npm are independent network-bound installers — overlap them.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(install_requirements),
+            executor.submit(setup_ebird_mcp),
+        ]
+        for future in futures:
+            future.result()
+    print("\n🚀 Ready! Run: ADK_WEB=1 adk web")